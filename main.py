@@ -1,16 +1,34 @@
 """Voice-Activated Music Assistant"""
+from __future__ import annotations
 import os
-import json
-import pyaudio
-import tempfile
+import sys
+import io
+import collections
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
 import wave
-import openai
-from typing import cast
+import pyaudio
+import webrtcvad  # type: ignore
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterator, Optional
 from dotenv import load_dotenv
 import spotipy  # type: ignore
+from spotipy.exceptions import SpotifyException  # type: ignore
 from vosk import Model, KaldiRecognizer  # type: ignore
+from wake_word import extract_result, heard_wake_word, make_wake_recognizer, wake_word_worker
 from spotipy.oauth2 import SpotifyOAuth  # type: ignore
 
+# The Whisper backends are heavy and optional, so they are only imported by
+# get_openai_client() and get_whisper_model(). Wake-word worker processes
+# re-import this module when they are spawned and never load them.
+if TYPE_CHECKING:
+    import openai
+    from faster_whisper import WhisperModel  # type: ignore
+
 try:
     load_dotenv()
 except ImportError as e:
@@ -23,35 +41,214 @@ SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "model")
 SPOTIFY_REDIRECT_URI = os.getenv("SPOTIFY_REDIRECT_URI", "http://localhost:8888/callback")
+SPOTIFY_CACHE_PATH = os.getenv("SPOTIFY_CACHE_PATH", ".cache")
+# Refresh the Spotify access token this long before it expires
+SPOTIFY_TOKEN_REFRESH_MARGIN = 300
+DEBUG = os.getenv("DEBUG", "0") == "1"
+# "assistant" runs the voice assistant, "long" transcribes the audio files given on the command line
+MODE = os.getenv("MODE", "assistant")
+LONG_FORM_MODEL = os.getenv("LONG_FORM_MODEL", "openai/whisper-large-v2")
+# Number of worker processes spotting the wake word; 0 decodes in this process
+WAKE_WORKERS = int(os.getenv("WAKE_WORKERS", "0"))
+# Language spoken to the assistant, as an ISO-639-1 code
+LANGUAGE = os.getenv("LANGUAGE", "ru")
+# Transcribe commands with Whisper instead of reusing the Vosk recognizer
+USE_WHISPER = os.getenv("USE_WHISPER", "0") == "1"
+# "local" runs faster-whisper on this machine, "openai" uses the Whisper API
+WHISPER_BACKEND = os.getenv("WHISPER_BACKEND", "local")
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "small")
+
+_openai_client: Optional[openai.OpenAI] = None
+_whisper_model: Optional[WhisperModel] = None
+
+# The single microphone is stream 0 when routing audio to wake-word workers
+MIC_STREAM_ID = 0
+
+# 100 ms chunks; raise to 3200 (200 ms) if a slow device reports input overflows
+AUDIO_CHUNK_FRAMES = int(os.getenv("AUDIO_CHUNK_FRAMES", "1600"))
+# How much unread microphone audio to keep before dropping the oldest chunks
+AUDIO_RING_SECONDS = 3
+
+# A Vosk partial that stays unchanged this long is taken as the final command
+STABLE_PARTIAL_MS = 750
+COMMAND_MAX_SECONDS = float(os.getenv("COMMAND_MAX_SECONDS", "5"))
+
+# Whisper API requests cover at most 30 s; longer phrases are split into
+# overlapping chunks that are transcribed concurrently
+WHISPER_WINDOW_SECONDS = 30
+WHISPER_CHUNK_SECONDS = 25
+WHISPER_CHUNK_OVERLAP_SECONDS = 2
+WHISPER_MAX_CONCURRENCY = 4
+
+VAD_FRAME_MS = 20
+VAD_FRAME_SAMPLES = 16000 * VAD_FRAME_MS // 1000
+VAD_PREROLL_FRAMES = 25
+VAD_TRAILING_SILENCE_MS = 500
+
+class AudioRing:
+    """
+    Bounded buffer of microphone chunks shared by the PyAudio callback and its consumers.
+
+    The callback only appends to a deque, which never blocks and drops the
+    oldest audio when consumers fall behind. Consumers wait on an Event for
+    new chunks instead of blocking inside stream.read.
+    """
+
+    def __init__(self, seconds: float = AUDIO_RING_SECONDS):
+        maxlen = max(1, int(seconds * 16000 / AUDIO_CHUNK_FRAMES))
+        self._chunks: collections.deque[bytes] = collections.deque(maxlen=maxlen)
+        self._ready = threading.Event()
+        self._closed = False
+
+    def callback(self, in_data, frame_count, time_info, status):
+        """PyAudio stream callback storing every captured chunk."""
+        if DEBUG:
+            if status & pyaudio.paInputOverflow:
+                print("Audio input overflow; consider raising AUDIO_CHUNK_FRAMES.")
+            if len(self._chunks) == self._chunks.maxlen:
+                print("Audio ring full, dropping the oldest unread chunk.")
+        self._chunks.append(in_data)
+        self._ready.set()
+        return (None, pyaudio.paContinue)
 
-def record_phrase(stream: pyaudio.Stream, seconds: float = 5) -> bytes:
-    """Records audio from the stream for a given duration."""
-    frames = []
-    for _ in range(int(16000/4000 * seconds)):
-        data = stream.read(4000, exception_on_overflow=False)
-        frames.append(data)
-    return b''.join(frames)
+    def close(self) -> None:
+        """Wakes up waiting consumers; get() returns None from now on once drained."""
+        self._closed = True
+        self._ready.set()
 
-def search_and_play(sp: spotipy.Spotify, query: str):
+    def get(self) -> Optional[bytes]:
+        """Returns the oldest unread chunk, waiting for one if needed, or None once closed."""
+        while True:
+            try:
+                return self._chunks.popleft()
+            except IndexError:
+                if self._closed:
+                    return None
+            self._ready.clear()
+            # Re-check after clearing so a chunk appended in between is not missed
+            if not self._chunks and not self._closed:
+                self._ready.wait()
+
+def read_frames(audio_ring: AudioRing, frame_bytes: int) -> Iterator[bytes]:
+    """Re-slices the chunks arriving in audio_ring into frames of exactly frame_bytes."""
+    pending = bytearray()
+    while True:
+        chunk = audio_ring.get()
+        if chunk is None:
+            return
+        pending += chunk
+        while len(pending) >= frame_bytes:
+            yield bytes(pending[:frame_bytes])
+            del pending[:frame_bytes]
+
+def record_phrase(audio_ring: AudioRing, max_seconds: float = COMMAND_MAX_SECONDS) -> np.ndarray:
+    """
+    Records a phrase from the microphone, stopping once the speaker goes quiet.
+
+    Audio is read in 20 ms frames and classified with WebRTC VAD. Recording
+    starts on the first speech frame (keeping a short pre-roll so the onset
+    is not clipped) and ends after ~500 ms of trailing silence, or once
+    max_seconds of audio have been read.
+
+    Args:
+        audio_ring: Buffer fed by the microphone callback (16-bit, 16kHz, mono).
+        max_seconds: Upper bound on the amount of audio to read.
+
+    Returns:
+        The int16 samples of the phrase, empty if no speech was heard.
+    """
+    vad = webrtcvad.Vad(2)
+    preroll: collections.deque[bytes] = collections.deque(maxlen=VAD_PREROLL_FRAMES)
+    total_frames = int(max_seconds * 1000 / VAD_FRAME_MS)
+    # Preallocate room for the whole phrase and copy frames straight into
+    # the sample array through a byte view of it
+    pcm = np.empty(total_frames * VAD_FRAME_SAMPLES, dtype=np.int16)
+    buf = memoryview(pcm).cast("B")
+    off = 0
+    silence_frames = 0
+    frames = read_frames(audio_ring, VAD_FRAME_SAMPLES * 2)
+    for frame in itertools.islice(frames, total_frames):
+        is_speech = vad.is_speech(frame, 16000)
+        if not off:
+            preroll.append(frame)
+            if is_speech:
+                for chunk in preroll:
+                    buf[off:off + len(chunk)] = chunk
+                    off += len(chunk)
+            continue
+        buf[off:off + len(frame)] = frame
+        off += len(frame)
+        silence_frames = 0 if is_speech else silence_frames + 1
+        if silence_frames * VAD_FRAME_MS >= VAD_TRAILING_SILENCE_MS:
+            break
+    frames.close()
+    return pcm[:off // 2]
+
+class PlayController:
+    """
+    Spotify client wrapper that remembers the playback device between commands.
+
+    The device is looked up with sp.devices() only on first use, and again
+    when Spotify reports that the remembered device is gone.
+    """
+
+    def __init__(self, sp: spotipy.Spotify):
+        self.sp = sp
+        self.device_id: Optional[str] = None
+
+    def resolve_device(self) -> Optional[str]:
+        """Looks up the first available Spotify device and remembers its id."""
+        devices = self.sp.devices()
+        if devices and devices["devices"]:
+            self.device_id = devices["devices"][0]["id"]
+        else:
+            self.device_id = None
+        return self.device_id
+
+    def play(self, uri: str) -> bool:
+        """Starts playing uri on the remembered device; returns False if there is no device."""
+        device_id = self.device_id or self.resolve_device()
+        if not device_id:
+            return False
+        try:
+            self.sp.start_playback(device_id=device_id, uris=[uri])
+        except SpotifyException as e:
+            if e.http_status != 404:
+                raise
+            # The remembered device went away, look it up once more
+            device_id = self.resolve_device()
+            if not device_id:
+                return False
+            self.sp.start_playback(device_id=device_id, uris=[uri])
+        return True
+
+def prewarm_spotify(controller: PlayController) -> None:
+    """Looks up the playback device ahead of the first command, if none is remembered yet."""
+    if controller.device_id is not None:
+        return
+    try:
+        controller.resolve_device()
+    except Exception as e:
+        if DEBUG:
+            print(f"Spotify warm-up failed: {e}")
+
+def search_and_play(controller: PlayController, query: str):
     """
     Searches for a track on Spotify using the provided query and plays the first result.
 
     Args:
-        sp: An authenticated Spotipy client instance.
+        controller: Wrapper around an authenticated Spotipy client instance.
         query: The search query (e.g., song title and artist).
 
     Returns:
         True if the track was found and playback started, False otherwise.
     """
     try:
-        results = sp.search(q=query, type="track", limit=1)
+        results = controller.sp.search(q=query, type="track", limit=1)
         if results["tracks"]["items"]:
             track = results["tracks"]["items"][0]
-            devices = sp.devices()
 
-            if devices and devices["devices"]:
-                device_id = devices["devices"][0]["id"]
-                sp.start_playback(device_id=device_id, uris=[track["uri"]])
+            if controller.play(track["uri"]):
                 print(f"Playing '{track['name']}' by {track['artists'][0]['name']}.")
                 return True
             else:
@@ -65,67 +262,330 @@ def search_and_play(sp: spotipy.Spotify, query: str):
         print(f"Error searching and playing track: {e}")
         return False
 
-def transcribe(data: bytes) -> str:
+def get_whisper_model() -> WhisperModel:
     """
-    Transcribes the given audio data using OpenAI's Whisper model.
+    Returns the shared faster-whisper model, loading it on first use.
+
+    Weights are int8-quantized: on a CUDA GPU activations run in fp16
+    (int8_float16), on CPU everything runs in int8.
+    """
+    global _whisper_model
+    if _whisper_model is None:
+        import ctranslate2  # type: ignore
+        from faster_whisper import WhisperModel  # type: ignore
+
+        if ctranslate2.get_cuda_device_count() > 0:
+            device, compute_type = "cuda", "int8_float16"
+        else:
+            device, compute_type = "cpu", "int8"
+        _whisper_model = WhisperModel(WHISPER_MODEL,
+                                      device=device,
+                                      compute_type=compute_type,
+                                      cpu_threads=os.cpu_count() or 0)
+    return _whisper_model
 
-    The function saves the raw audio data to a temporary WAV file,
-    sends it to the OpenAI API for transcription, and then deletes
-    the temporary file.
+def get_openai_client() -> openai.OpenAI:
+    """Returns the shared OpenAI client, creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        import openai
+
+        _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+def prewarm_openai() -> None:
+    """Opens the pooled HTTPS connection to OpenAI so the upload skips the handshake."""
+    try:
+        # with_options shares the underlying HTTP client and its connection pool;
+        # no retries, a failed warm-up is not worth waiting for
+        get_openai_client().with_options(timeout=2, max_retries=0).models.list()
+    except Exception as e:
+        if DEBUG:
+            print(f"OpenAI warm-up failed: {e}")
+
+def transcribe(pcm: np.ndarray) -> str:
+    """
+    Transcribes the given audio data using Whisper.
+
+    By default the audio is decoded locally with an int8-quantized
+    faster-whisper model. With WHISPER_BACKEND=openai it is sent to
+    OpenAI's Whisper API instead.
 
     Args:
-        data: A bytes object containing the raw audio data (16-bit, 16kHz, mono).
+        pcm: The int16 samples of the audio (16kHz, mono).
 
     Returns:
         The transcribed text as a string.
     """
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-        tempfile_name = temp_file.name
-    wav_file = cast(wave.Wave_write, wave.open(tempfile_name, "wb"))
-    try:
+    if WHISPER_BACKEND == "openai":
+        return transcribe_openai(pcm)
+
+    # One cast plus an in-place scale, without a temporary for the division
+    audio = pcm.astype(np.float32)
+    audio *= 1.0 / 32768.0
+    segments, _ = get_whisper_model().transcribe(audio,
+                                                 language=LANGUAGE,
+                                                 beam_size=1,
+                                                 vad_filter=True)
+    return " ".join(segment.text for segment in segments).strip()
+
+def _wav_buffer(pcm: np.ndarray) -> io.BytesIO:
+    """Wraps int16 16kHz mono samples in an in-memory WAV file."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav_file:
         wav_file.setnchannels(1)
         wav_file.setsampwidth(2)
         wav_file.setframerate(16000)
-        wav_file.writeframes(data)
-    finally:
-        wav_file.close()
+        wav_file.writeframes(pcm)
+    buf.seek(0)
+    # The API infers the audio format from the file name
+    buf.name = "audio.wav"
+    return buf
+
+def _split_pcm(pcm: np.ndarray,
+               seconds: float = WHISPER_CHUNK_SECONDS,
+               overlap: float = WHISPER_CHUNK_OVERLAP_SECONDS) -> list[io.BytesIO]:
+    """Splits samples into WAV chunks of the given length that overlap by overlap seconds."""
+    size = int(seconds * 16000)
+    step = size - int(overlap * 16000)
+    chunks = []
+    start = 0
+    while True:
+        chunks.append(_wav_buffer(pcm[start:start + size]))
+        if start + size >= len(pcm):
+            return chunks
+        start += step
+
+def _merge_overlap(left: str, right: str, max_words: int = 12) -> str:
+    """Joins two transcripts, dropping the words at the start of right that repeat the end of left."""
+    def normalize(word: str) -> str:
+        return word.strip(".,!?;:\"'«»—-").lower()
 
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    left_words, right_words = left.split(), right.split()
+    left_norm = [normalize(word) for word in left_words[-max_words:]]
+    right_norm = [normalize(word) for word in right_words[:max_words]]
+    for size in range(min(len(left_norm), len(right_norm)), 0, -1):
+        if left_norm[-size:] == right_norm[:size]:
+            right_words = right_words[size:]
+            break
+    return " ".join(left_words + right_words)
 
-    # Open the WAV file in binary mode when sending to OpenAI
-    with open(tempfile_name, "rb") as audio_file:
-        transcript = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            language="ru"
-        )
+def _transcribe_wav(buf: io.BytesIO) -> str:
+    """Sends one WAV file to OpenAI's Whisper API and returns the text."""
+    # A plain-text response skips building a response model from JSON
+    transcript = get_openai_client().audio.transcriptions.create(
+        model="whisper-1",
+        file=buf,
+        language=LANGUAGE,
+        response_format="text"
+    )
+    return transcript.strip()
 
-    os.unlink(tempfile_name)
-    return transcript.text.strip()
+def transcribe_openai(pcm: np.ndarray) -> str:
+    """
+    Transcribes the given audio data using OpenAI's Whisper API.
+
+    The function wraps the raw audio data in an in-memory WAV file
+    and sends it to the OpenAI API for transcription. Audio longer than
+    Whisper's 30 s window is split into overlapping chunks which are
+    transcribed concurrently and stitched back together in order.
+
+    Args:
+        pcm: The int16 samples of the audio (16kHz, mono).
+
+    Returns:
+        The transcribed text as a string.
+    """
+    if len(pcm) <= WHISPER_WINDOW_SECONDS * 16000:
+        return _transcribe_wav(_wav_buffer(pcm))
+
+    chunks = _split_pcm(pcm)
+    with ThreadPoolExecutor(max_workers=WHISPER_MAX_CONCURRENCY) as pool:
+        texts = list(pool.map(_transcribe_wav, chunks))
+    text = texts[0]
+    for chunk_text in texts[1:]:
+        text = _merge_overlap(text, chunk_text)
+    return text
+
+def load_long_form_pipeline():
+    """
+    Loads the batched transformers Whisper pipeline used for long recordings.
+
+    torch and transformers are only needed for MODE=long, so they are
+    imported here rather than at module level. The model runs in fp16 on
+    the first CUDA device when one is available.
+    """
+    import torch  # type: ignore
+    from transformers import pipeline  # type: ignore
+
+    cuda = torch.cuda.is_available()
+    pipe = pipeline("automatic-speech-recognition",
+                    LONG_FORM_MODEL,
+                    torch_dtype=torch.float16 if cuda else torch.float32,
+                    device="cuda:0" if cuda else "cpu")
+    try:
+        pipe.model = pipe.model.to_bettertransformer()
+    except (ImportError, ValueError) as e:
+        # optimum is not installed or the installed transformers no longer needs it
+        print(f"BetterTransformer unavailable, using default attention: {e}")
+    return pipe
+
+def transcribe_long(pipe, path: str) -> str:
+    """
+    Transcribes a long audio file with the batched Whisper pipeline.
+
+    The file is cut into 30 s windows which are decoded 24 at a time.
+
+    Args:
+        pipe: Pipeline returned by load_long_form_pipeline().
+        path: Path to an audio file readable by ffmpeg.
+
+    Returns:
+        The transcribed text as a string.
+    """
+    result = pipe(path,
+                  chunk_length_s=30,
+                  batch_size=24,
+                  return_timestamps=True,
+                  generate_kwargs={"language": LANGUAGE})
+    return result["text"].strip()
+
+class WakeWordPool:
+    """
+    Spots the wake word in worker processes so decoding is not bound by the GIL.
+
+    Audio streams are routed to workers round-robin by stream id; every
+    worker runs on its own core with single-threaded BLAS. There is never
+    more than one worker per stream, since extra workers would sit idle.
+    """
+
+    def __init__(self, workers: int, streams: int):
+        workers = max(1, min(workers, streams))
+        # Spawned children load Kaldi's BLAS fresh, so these limits apply to them
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ.setdefault(var, "1")
+        ctx = multiprocessing.get_context("spawn")
+        self._wakes = ctx.Queue()
+        self._inputs = [ctx.Queue() for _ in range(workers)]
+        self._processes = [ctx.Process(target=wake_word_worker,
+                                       args=(worker_id, VOSK_MODEL_PATH, WAKE_WORD,
+                                             chunks, self._wakes),
+                                       daemon=True)
+                           for worker_id, chunks in enumerate(self._inputs)]
+        for process in self._processes:
+            process.start()
+
+    def feed(self, stream_id: int, data: bytes) -> None:
+        """Routes a chunk of the given stream to its worker."""
+        self._inputs[stream_id % len(self._inputs)].put((stream_id, data))
 
-def listen_for_wake_word(recognizer : KaldiRecognizer, stream: pyaudio.Stream) -> None:
-    """Listen for the wake word."""
+    def poll(self) -> set[int]:
+        """
+        Returns the ids of the streams that heard the wake word since the last poll.
+
+        Raises:
+            RuntimeError: If a worker process has exited, e.g. because its
+                Vosk model failed to load; its streams would otherwise go
+                unheard while their audio piles up in the queue.
+        """
+        for worker_id, process in enumerate(self._processes):
+            if not process.is_alive():
+                raise RuntimeError(f"Wake-word worker {worker_id} exited "
+                                   f"with code {process.exitcode}.")
+        woken = set()
+        while True:
+            try:
+                woken.add(self._wakes.get_nowait())
+            except queue.Empty:
+                return woken
+
+    def close(self) -> None:
+        """Stops the worker processes."""
+        for chunks in self._inputs:
+            chunks.put(None)
+        for process in self._processes:
+            process.join(timeout=1)
+
+def listen_for_wake_word(wake_recognizer: Optional[KaldiRecognizer],
+                         audio_ring: AudioRing,
+                         command_recognizer: Optional[KaldiRecognizer] = None,
+                         on_wake: Optional[Callable[[], None]] = None,
+                         wake_pool: Optional[WakeWordPool] = None) -> str:
+    """
+    Listen for the wake word, optionally followed by a command.
+
+    The wake word is spotted with wake_recognizer, which is expected to be
+    constrained to a tiny grammar, or by wake_pool when given. When
+    command_recognizer is given, audio after the wake word is decoded with
+    it and the next utterance is returned as the command. The command is
+    final once Vosk closes the utterance, or once its partial result has
+    stayed the same for STABLE_PARTIAL_MS.
+
+    Args:
+        wake_recognizer: Vosk recognizer used while waiting for the wake word.
+        audio_ring: Buffer fed by the microphone callback.
+        command_recognizer: Full-vocabulary Vosk recognizer for the command.
+        on_wake: Called as soon as the wake word is detected.
+        wake_pool: Worker processes to spot the wake word in instead.
+
+    Returns:
+        The command text, or an empty string if no command was captured.
+    """
+    waiting_for_wake_word = True
+    last_partial = ""
+    stable_chunks = 0
+    command_chunks = 0
+    chunk_ms = AUDIO_CHUNK_FRAMES * 1000 // 16000
     while True:
-        data = stream.read(4000, exception_on_overflow=False)
-        if recognizer.AcceptWaveform(data):
-            result = json.loads(recognizer.Result()).get("text", "")
-            if WAKE_WORD in result.lower():
-                print("Wake word detected.")
-                return
-        partial = recognizer.PartialResult()
-        if partial and len(partial) > 100:
-            print(f"Partial: {partial}")
-            recognizer.Reset()
+        data = audio_ring.get()
+        if data is None:
+            return ""
+        if waiting_for_wake_word:
+            if wake_pool is not None:
+                wake_pool.feed(MIC_STREAM_ID, data)
+                woken = MIC_STREAM_ID in wake_pool.poll()
+            else:
+                woken = heard_wake_word(wake_recognizer, data, WAKE_WORD, DEBUG)
+            if not woken:
+                continue
+            print("Wake word detected.")
+            if on_wake:
+                on_wake()
+            if command_recognizer is None:
+                return ""
+            print("Listening for command...")
+            command_recognizer.Reset()
+            waiting_for_wake_word = False
+            continue
+
+        command_chunks += 1
+        if command_recognizer.AcceptWaveform(data):
+            text = extract_result("text", command_recognizer.Result())
+            if text:
+                return text
+            continue
+        partial = extract_result("partial", command_recognizer.PartialResult())
+        if partial and partial == last_partial:
+            stable_chunks += 1
+        else:
+            stable_chunks = 0
+        last_partial = partial
+        if (stable_chunks * chunk_ms >= STABLE_PARTIAL_MS
+                or command_chunks * chunk_ms >= COMMAND_MAX_SECONDS * 1000):
+            command_recognizer.Reset()
+            return last_partial
 
 
 def init_spotify_client():
-    """Initialize and return a Spotify client."""
+    """Initialize and return a Spotify play controller together with its OAuth manager."""
     scope = "user-read-playback-state,user-modify-playback-state"
     sp_oauth = SpotifyOAuth(client_id=SPOTIFY_CLIENT_ID,
                             client_secret=SPOTIFY_CLIENT_SECRET,
                             redirect_uri=SPOTIFY_REDIRECT_URI,
                             scope=scope,
+                            cache_path=SPOTIFY_CACHE_PATH,
                             open_browser=True) # Changed to automatically open browser
+    # Returns the token persisted in the cache file, refreshed if it has expired
     token_info = sp_oauth.get_cached_token()
     if not token_info:
         # This will now open a browser and wait for the user to authenticate
@@ -133,43 +593,129 @@ def init_spotify_client():
         # or it will prompt for the URL if it cannot.
         # For this to work seamlessly, ensure you have a web server (like Flask or Django)
         # or use a simple http.server if needed, but Spotipy often handles this.
-        token_info = sp_oauth.get_access_token(as_dict=False)
+        access_token = sp_oauth.get_access_token(as_dict=False)
+        if not access_token:
+            print("Spotify authorization failed.")
+            return None, sp_oauth
+        token_info = sp_oauth.get_cached_token()
+        if not token_info:
+            # Still usable until it expires, it just cannot be refreshed in the background
+            print(f"Could not cache the Spotify token at '{SPOTIFY_CACHE_PATH}'; "
+                  "it will not be refreshed automatically.")
+            return PlayController(spotipy.Spotify(auth=access_token)), sp_oauth
 
-    return spotipy.Spotify(auth=token_info)
+    return PlayController(spotipy.Spotify(auth=token_info["access_token"])), sp_oauth
+
+def keep_spotify_token_fresh(sp: spotipy.Spotify, sp_oauth: SpotifyOAuth) -> None:
+    """
+    Refreshes the Spotify access token shortly before it expires.
+
+    Meant to run on a daemon thread so that no user command ever waits for a
+    token refresh. The new token is saved to the cache by Spotipy and
+    swapped into the client in place. Without a cached token there is no
+    refresh token or expiry to work from, so the thread exits.
+    """
+    token_info = sp_oauth.get_cached_token()
+    if not token_info:
+        print("No cached Spotify token, background token refresh is disabled.")
+        return
+    while True:
+        time.sleep(max(token_info["expires_at"] - time.time() - SPOTIFY_TOKEN_REFRESH_MARGIN, 0))
+        try:
+            token_info = sp_oauth.refresh_access_token(token_info["refresh_token"])
+            sp._auth = token_info["access_token"]
+        except Exception as e:
+            print(f"Error refreshing Spotify token: {e}")
+            time.sleep(60)
 
 def main() -> None:
     """Main function to run the voice assistant."""
+    if MODE == "long":
+        if len(sys.argv) < 2:
+            print("Usage: MODE=long python main.py <audio file> [<audio file> ...]")
+            return
+        pipe = load_long_form_pipeline()
+        for path in sys.argv[1:]:
+            print(transcribe_long(pipe, path))
+        return
+
     if not os.path.exists(VOSK_MODEL_PATH):
         print(f"Please download the Vosk model and unpack it to the '{VOSK_MODEL_PATH}' directory.")
         return
 
     model = Model(VOSK_MODEL_PATH)
-    spotify_client = init_spotify_client()
-    if not spotify_client:
+    controller, sp_oauth = init_spotify_client()
+    if not controller:
         return
+    threading.Thread(target=keep_spotify_token_fresh,
+                     args=(controller.sp, sp_oauth),
+                     daemon=True).start()
     audio = pyaudio.PyAudio()
+    audio_ring = AudioRing()
     stream = audio.open(format=pyaudio.paInt16,
                         channels=1,
                         rate=16000,
                         input=True,
-                        frames_per_buffer=4000)
-    recognizer = KaldiRecognizer(model, 16000)
+                        frames_per_buffer=AUDIO_CHUNK_FRAMES,
+                        stream_callback=audio_ring.callback)
+    # Records the command and warms up connections in the background
+    executor = ThreadPoolExecutor(max_workers=3)
+    wake_pool = None
+    wake_recognizer = None
+    if WAKE_WORKERS > 0:
+        wake_pool = WakeWordPool(WAKE_WORKERS, streams=MIC_STREAM_ID + 1)
+    else:
+        wake_recognizer = make_wake_recognizer(model, WAKE_WORD)
+    command_recognizer = None
+    if not USE_WHISPER:
+        command_recognizer = KaldiRecognizer(model, 16000)
+        command_recognizer.SetWords(False)
+        command_recognizer.SetMaxAlternatives(0)
+
+    if USE_WHISPER:
+        # Set up the backend up front so the first command does not pay for it
+        if WHISPER_BACKEND == "openai":
+            get_openai_client()
+        else:
+            get_whisper_model()
+
+    def on_wake() -> None:
+        executor.submit(prewarm_spotify, controller)
 
     print("Voice assistant is running...")
 
     try:
         while True:
-            listen_for_wake_word(recognizer, stream)
-            print("Listening for command...")
-            data = record_phrase(stream)
-            text = transcribe(data)
+            text = listen_for_wake_word(wake_recognizer, audio_ring,
+                                        command_recognizer, on_wake, wake_pool)
+            if USE_WHISPER:
+                print("Listening for command...")
+                phrase = executor.submit(record_phrase, audio_ring)
+                if WHISPER_BACKEND == "openai":
+                    executor.submit(prewarm_openai)
+                pcm = phrase.result()
+                if not len(pcm):
+                    print("No command heard.")
+                    continue
+                try:
+                    text = transcribe(pcm)
+                except Exception as e:
+                    print(f"Error transcribing command: {e}")
+                    continue
             print(text)
-            search_and_play(spotify_client, text)
+            if text:
+                search_and_play(controller, text)
     except KeyboardInterrupt:
         print("Voice assistant stopped.")
+    except RuntimeError as e:
+        print(f"Voice assistant stopped: {e}")
     finally:
         stream.stop_stream()
         stream.close()
+        audio_ring.close()
+        if wake_pool is not None:
+            wake_pool.close()
+        executor.shutdown(wait=False, cancel_futures=True)
         audio.terminate()
 
 if __name__ == "__main__":
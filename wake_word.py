@@ -0,0 +1,68 @@
+"""Vosk wake-word spotting, importable without the rest of the assistant.
+
+Wake-word worker processes run the entry point defined here and only need
+Vosk; the optional Whisper backends used by main.py are never loaded in them.
+"""
+import os
+import json
+from vosk import Model, KaldiRecognizer  # type: ignore
+
+
+def extract_result(field: str, result: str) -> str:
+    """Pulls a string field out of Vosk's flat JSON result without a full JSON parse."""
+    key = f'"{field}" : "'
+    start = result.find(key)
+    if start == -1:
+        return ""
+    start += len(key)
+    return result[start:result.find('"', start)]
+
+def make_wake_recognizer(model: Model, wake_word: str) -> KaldiRecognizer:
+    """Creates a Vosk recognizer restricted to the wake word."""
+    # Restricting the recognizer to a one-word grammar keeps the always-on
+    # decoding cheap; the full vocabulary is only used for commands
+    recognizer = KaldiRecognizer(model, 16000, json.dumps([wake_word, "[unk]"]))
+    # Word timings and n-best alternatives are never read, skip computing them
+    recognizer.SetWords(False)
+    recognizer.SetMaxAlternatives(0)
+    return recognizer
+
+def heard_wake_word(recognizer: KaldiRecognizer,
+                    data: bytes,
+                    wake_word: str,
+                    debug: bool = False) -> bool:
+    """Feeds one chunk to a wake-word recognizer and reports whether the wake word was said."""
+    if recognizer.AcceptWaveform(data):
+        return wake_word in extract_result("text", recognizer.Result()).lower()
+    partial = recognizer.PartialResult()
+    if partial and len(partial) > 100:
+        if debug:
+            print(f"Partial: {partial}")
+        recognizer.Reset()
+    return False
+
+def wake_word_worker(worker_id: int, model_path: str, wake_word: str, chunks, wakes) -> None:
+    """
+    Process entry point spotting the wake word in the audio streams routed to it.
+
+    The worker pins itself to one CPU, loads its own Vosk model and keeps a
+    wake-word recognizer per stream. It reads (stream_id, chunk) pairs from
+    chunks, puts the stream_id on wakes whenever the wake word is heard, and
+    exits on None. If the model cannot be loaded the worker exits with a
+    non-zero exit code, which the parent checks for.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[worker_id % len(cpus)]})
+    model = Model(model_path)
+    recognizers: dict[int, KaldiRecognizer] = {}
+    while True:
+        item = chunks.get()
+        if item is None:
+            return
+        stream_id, data = item
+        recognizer = recognizers.get(stream_id)
+        if recognizer is None:
+            recognizer = recognizers[stream_id] = make_wake_recognizer(model, wake_word)
+        if heard_wake_word(recognizer, data, wake_word):
+            wakes.put(stream_id)